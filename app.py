@@ -1,22 +1,49 @@
 import os
-import time
+import atexit
 import threading
+from concurrent.futures import ThreadPoolExecutor
 from flask import Flask, request, jsonify
 from flask_cors import CORS
 from run_script_local import execute_and_notify
 from dotenv import load_dotenv
-from file_based_job_manager import FileBasedJobManager
+import tasks
+from file_based_job_manager import FileBasedJobManager, FileBasedJobIdMap
 from datetime import datetime
 
+try:
+    import orjson
+except ImportError:
+    # orjson is optional; handlers fall back to Flask's stdlib JSON
+    orjson = None
+
 load_dotenv()
 
+# Configuration is read and parsed once at import instead of per request
+MAX_RETRY_COUNT = int(os.getenv('MAX_RETRY_COUNT', 3))
+RETRY_DELAY_MS = int(os.getenv('RETRY_DELAY_MS', 300))
+LOGS_DIR = os.getenv('LOGS_DIR', './logs')
+LOG_CHECK_TIMEOUT = os.getenv('LOG_CHECK_TIMEOUT', '300')
+LOG_POLL_INTERVAL = os.getenv('LOG_POLL_INTERVAL', '10')
+
 app = Flask(__name__)
 CORS(app)
 
-# Initialize job manager and job ID mapping
+# Bounded worker pool for background jobs (avoids unbounded thread creation under bursts)
+JOB_EXECUTOR = ThreadPoolExecutor(
+    max_workers=int(os.getenv('WORKER_POOL_SIZE', 8)),
+    thread_name_prefix='feedjob'
+)
+atexit.register(JOB_EXECUTOR.shutdown, wait=False)
+
+# Initialize job manager and persistent job ID mapping
+# (file-backed so retries and status lookups survive restarts/multi-worker deploys)
 job_manager = FileBasedJobManager()
-job_id_mapping = {}  # frontend_job_id -> backend_job_id
-reverse_job_id_mapping = {}  # backend_job_id -> frontend_job_id
+job_id_map = FileBasedJobIdMap()
+
+# Per-job events so status long-polls wake up on transitions instead of
+# re-polling. Entries are only created for jobs that exist and are removed
+# when the job finishes, so request-supplied IDs can't grow the dict forever.
+JOB_EVENTS = {}
 
 # Status enums (as strings)
 class JobStatus:
@@ -24,73 +51,139 @@ class JobStatus:
     VALIDATED = 'validated'
     VALIDATION_FAILED = 'validation_failed'
 
+# States a job never leaves; long-polls on these return immediately
+TERMINAL_STATUSES = frozenset({JobStatus.VALIDATED, JobStatus.VALIDATION_FAILED})
+
 class ActivitySource:
     UI = 'ui'
     CALLBACK = 'callback'
 
+
+# Callback (type, status) -> job status dispatch; unknown pairs are rejected
+# up front so new_status can never be unset on the update path
+STATUS_MAP = {
+    ('feed_validation', 'success'): JobStatus.VALIDATED,
+    ('feed_validation', 'failed'): JobStatus.VALIDATION_FAILED,
+}
+
+
+def _now_iso():
+    """Current UTC timestamp; call once per request and reuse the value"""
+    return datetime.utcnow().isoformat()
+
+
+def _wake_waiters(job_id):
+    """Wake long-poll waiters for a finished job and drop its event.
+
+    Transitions we signal are all terminal, so the entry is done once set;
+    popping it keeps JOB_EVENTS bounded by the number of in-flight jobs.
+    """
+    event = JOB_EVENTS.pop(job_id, None)
+    if event is not None:
+        event.set()
+
+
+def _json(req):
+    """Parse the request body with orjson when available.
+
+    cache=False keeps Werkzeug from holding a second copy of the raw bytes
+    on the request object for the rest of the handler. Returns None for a
+    malformed or non-object body so callers can answer 400 instead of
+    raising (handlers go straight to .get()).
+    """
+    if orjson is not None:
+        try:
+            data = orjson.loads(req.get_data(cache=False))
+        except orjson.JSONDecodeError:
+            return None
+    else:
+        data = req.get_json(force=True, silent=True)
+    if not isinstance(data, dict):
+        return None
+    return data
+
+
+def _resp(obj, code=200):
+    """JSON response, serialized with orjson when available"""
+    if orjson is not None:
+        return app.response_class(orjson.dumps(obj), status=code, mimetype='application/json')
+    resp = jsonify(obj)
+    resp.status_code = code
+    return resp
+
+
+# Request schema for the validate endpoint, built once at import time
+VALIDATE_REQUIRED_FIELDS = ('job_id', 'source_s3_path', 'destination_s3_path', 'affiliate_merchant_id')
+S3_PATH_FIELDS = ('source_s3_path', 'destination_s3_path')
+S3_PREFIX = 's3://'
+
+
+def _error_response(err, response_status=400):
+    """Standard failure envelope for the feed validation endpoints"""
+    return _resp({
+        "job_id": 0,
+        "type": "feed_validation",
+        "status": "failed",
+        "response_status": response_status,
+        "result": {
+            "destination_s3_path": ""
+        },
+        "err": err
+    }, response_status)
+
+
+def _validate_payload(data):
+    """Return an error message for a bad validate payload, or None if it is valid.
+
+    Required-ness and s3:// prefixes are checked in one pass over the schema
+    instead of walking the payload twice.
+    """
+    missing = []
+    s3_error = None
+    for k in VALIDATE_REQUIRED_FIELDS:
+        v = data.get(k)
+        if not v:
+            missing.append(k)
+        elif k in S3_PATH_FIELDS and not (isinstance(v, str) and v.startswith(S3_PREFIX)):
+            s3_error = s3_error or f'{k} must start with {S3_PREFIX}'
+    if missing:
+        return f'Missing fields: {missing}'
+    return s3_error
+
+# Health probes hit this constantly; build the response once instead of
+# re-serializing {'ok': True} per probe
+_HEALTH_RESP = app.response_class(b'{"ok":true}', mimetype='application/json')
+
+
 @app.route('/')
 def health():
-    return jsonify({'ok': True})
+    return _HEALTH_RESP
 
 
 
 @app.route('/editorialist-tools/catalog/vendoronboarding/feed/validate', methods=['POST'])
 def trigger_feed_validation():
     """API: Trigger Validation - Creates new job or retries failed job"""
-    data = request.get_json(force=True)
-    
+    data = _json(request)
+    if data is None:
+        return _error_response('Invalid JSON body')
+
     # Extract frontend job_id
     frontend_job_id = data.get('job_id')
     
-    required_fields = ['job_id', 'source_s3_path', 'destination_s3_path', 'affiliate_merchant_id']
-    missing = [k for k in required_fields if k not in data or not data.get(k)]
-    
-    if missing:
-        return jsonify({
-            "job_id": 0,
-            "type": "feed_validation",
-            "status": "failed",
-            "response_status": 400,
-            "result": {
-                "destination_s3_path": ""
-            },
-            "err": f'Missing fields: {missing}'
-        }), 400
-    
-    # Validate S3 path format
-    for field in ['source_s3_path', 'destination_s3_path']:
-        if not data[field].startswith('s3://'):
-            return jsonify({
-                "job_id": 0,
-                "type": "feed_validation",
-                "status": "failed",
-                "response_status": 400,
-                "result": {
-                    "destination_s3_path": ""
-                },
-                "err": f'{field} must start with s3://'
-            }), 400
-    
+    error = _validate_payload(data)
+    if error:
+        return _error_response(error)
+
     # Check if frontend job_id already exists (for retry scenarios)
-    backend_job_id = job_id_mapping.get(frontend_job_id)
+    backend_job_id = job_id_map.get_backend(frontend_job_id)
     existing_job = job_manager.get_job(backend_job_id) if backend_job_id else None
     
     if existing_job:
         # Handle retry logic
         if existing_job['status'] == JobStatus.VALIDATION_FAILED:
-            max_retry_count = int(os.getenv('MAX_RETRY_COUNT', 3))
-            
-            if existing_job['retry_count'] >= max_retry_count:
-                return jsonify({
-                    "job_id": 0,
-                    "type": "feed_validation",
-                    "status": "failed",
-                    "response_status": 400,
-                    "result": {
-                        "destination_s3_path": ""
-                    },
-                    "err": f'Max retry count ({max_retry_count}) exceeded'
-                }), 400
+            if existing_job['retry_count'] >= MAX_RETRY_COUNT:
+                return _error_response(f'Max retry count ({MAX_RETRY_COUNT}) exceeded')
             
             retry_count = existing_job['retry_count'] + 1
             
@@ -101,18 +194,16 @@ def trigger_feed_validation():
                 'validation_destination_s3_path': data['destination_s3_path']
             })
             
-            # Update job
-            job_manager.update_job(existing_job['id'], {
-                'status': JobStatus.VALIDATING,
-                'retry_count': retry_count,
-                'job_data': job_data,
-                'updated_at': datetime.utcnow().isoformat()
-            })
-            
-            # Create activity for retry
-            job_manager.create_activity(
+            # Update job and record the retry activity in one pass
+            job_manager.update_and_log(
+                existing_job['id'],
+                {
+                    'status': JobStatus.VALIDATING,
+                    'retry_count': retry_count,
+                    'job_data': job_data,
+                    'updated_at': _now_iso()
+                },
                 entity='feed_generation_job',
-                entity_id=existing_job['id'],
                 source=ActivitySource.UI,
                 requested_by=data.get('requested_by', 'system'),
                 activity_data={
@@ -123,12 +214,10 @@ def trigger_feed_validation():
                 }
             )
             
-            # Execute validation script in background with delay
-            retry_delay_ms = int(os.getenv('RETRY_DELAY_MS', 300))
-            time.sleep(retry_delay_ms / 1000)  # Convert to seconds
-            execute_validation_script(existing_job['id'])
+            # Execute validation script in background after the retry delay
+            execute_validation_script(existing_job['id'], delay_s=RETRY_DELAY_MS / 1000)
             
-            return jsonify({
+            return _resp({
                 "job_id": frontend_job_id,
                 "type": "feed_validation",
                 "status": "success",
@@ -137,18 +226,9 @@ def trigger_feed_validation():
                     "destination_s3_path": data['destination_s3_path']
                 },
                 "err": ""
-            }), 200
+            })
         else:
-            return jsonify({
-                "job_id": 0,
-                "type": "feed_validation",
-                "status": "failed",
-                "response_status": 400,
-                "result": {
-                    "destination_s3_path": ""
-                },
-                "err": f'Job cannot be retried in current status: {existing_job["status"]}'
-            }), 400
+            return _error_response(f'Job cannot be retried in current status: {existing_job["status"]}')
     else:
         # Create new validation job
         job_data = {
@@ -164,9 +244,8 @@ def trigger_feed_validation():
             job_data=job_data
         )
         
-        # Map frontend job_id to backend job_id
-        job_id_mapping[frontend_job_id] = backend_job_id
-        reverse_job_id_mapping[backend_job_id] = frontend_job_id
+        # Map frontend job_id to backend job_id (persisted)
+        job_id_map.add(frontend_job_id, backend_job_id)
         
         job_manager.create_activity(
             entity='feed_generation_job',
@@ -184,7 +263,7 @@ def trigger_feed_validation():
         # Execute validation script in background
         execute_validation_script(backend_job_id)
         
-        return jsonify({
+        return _resp({
                 "job_id": frontend_job_id,
                 "type": "feed_validation",
                 "status": "success",
@@ -193,49 +272,56 @@ def trigger_feed_validation():
                     "destination_s3_path": data['destination_s3_path']
                 },
                 "err": ""
-            }), 200
+            })
 
 
 
 @app.route('/api/jobs', methods=['GET'])
 def list_all_jobs():
-    """List all jobs for debugging"""
+    """List jobs for debugging, paginated via ?limit/&offset/&status"""
     try:
-        jobs = job_manager.list_all_jobs()
-        return jsonify({
+        limit = request.args.get('limit', default=100, type=int)
+        offset = request.args.get('offset', default=0, type=int)
+        status = request.args.get('status')
+        jobs = job_manager.list_all_jobs(limit=limit, offset=offset, status=status)
+        return _resp({
             'jobs': jobs,
-            'total': len(jobs)
+            'total': job_manager.count_jobs(status),
+            'limit': limit,
+            'offset': offset
         })
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return _resp({'error': str(e)}, 500)
 
 @app.route('/api/mappings', methods=['GET'])
 def show_mappings():
     """Temporary endpoint to show job ID mappings"""
-    return jsonify({
-        'frontend_to_backend': job_id_mapping,
-        'backend_to_frontend': reverse_job_id_mapping,
-        'total_mappings': len(job_id_mapping)
+    forward, reverse = job_id_map.snapshot()
+    return _resp({
+        'frontend_to_backend': forward,
+        'backend_to_frontend': reverse,
+        'total_mappings': len(forward)
     })
 
 @app.route('/editorialist-tools/catalog/vendoronboarding/feed/validate/status/<job_id>', methods=['GET'])
 def get_job_status(job_id):
     """GET status endpoint"""
     # Check if job_id is frontend job_id, map to backend job_id
-    backend_job_id = job_id_mapping.get(job_id, job_id)
-    
+    backend_job_id = job_id_map.get_backend(job_id, job_id)
+
+    # Optional long-poll: ?wait=<seconds> blocks until the job transitions
+    # (or the timeout expires) instead of forcing clients to re-poll.
+    # type=float yields None for junk input, like limit/offset on /api/jobs;
+    # events are only registered for jobs that exist and are still running.
+    wait = request.args.get('wait', type=float)
+    if wait:
+        job = job_manager.get_job(backend_job_id)
+        if job and job.get('status') not in TERMINAL_STATUSES:
+            JOB_EVENTS.setdefault(backend_job_id, threading.Event()).wait(timeout=wait)
+
     job = job_manager.get_job(backend_job_id)
     if not job:
-        return jsonify({
-            "job_id": 0,
-            "type": "feed_validation",
-            "status": "failed",
-            "response_status": 404,
-            "result": {
-                "destination_s3_path": ""
-            },
-            "err": 'Job not found'
-        }), 404
+        return _error_response('Job not found', 404)
     
     # Return job status with frontend job_id in new format
     job_response = {
@@ -250,75 +336,157 @@ def get_job_status(job_id):
         "err": ""
     }
     
-    return jsonify(job_response), 200
+    return _resp(job_response)
 
 
 
-def execute_validation_script(job_id):
-    """Execute validation script in background (local execution)"""
-    def background():
-        try:
-            job = job_manager.get_job(job_id)
-            if not job:
-                app.logger.error('Job not found for validation: %s', job_id)
-                return
-            
-            job_data = job['job_data'] or {}
-            
-            opts = {
-                'mode': 'local',  # Always local since we're on same EC2
-                'ec2_host': None,  # Not needed for local execution
-                'ec2_user': None,  # Not needed for local execution
-                'key_path': None,   # Not needed for local execution
-                'logs_dir': os.getenv('LOGS_DIR', './logs'),
-                'run_at': None,    # Not needed for local execution
-                'partner_id': job['partner_id'],
-                's3_feed_file': job_data.get('validation_source_s3_path'),
-                's3_output_path': job_data.get('validation_destination_s3_path'),
-                'distinguish_id': f"{job_id}_validation",
-                'callback_url': None,  # Will be built from environment in run_script_local.py
-                'job_id': job_id,
-                'type': 'feed_validation',
-                'log_timeout': os.getenv('LOG_CHECK_TIMEOUT', '300'),
-                'log_poll_interval': os.getenv('LOG_POLL_INTERVAL', '10'),
-            }
-            
-            # Execute script
-            result = execute_and_notify(opts)
-            
-            # Update job status based on result
-            if result and isinstance(result, dict) and result.get('destination'):
-                # Script succeeded, update status to validated and update destination path
-                job_data = job['job_data'] or {}
-                # Use actual filename from script output
-                script_output_path = result.get('destination')
+@app.route('/api/callback/feed', methods=['POST'])
+def callback_receiver():
+    """API: Callback Handler - Receives script results and updates job status"""
+    payload = _json(request)
+    if payload is None:
+        return _error_response('Invalid JSON body')
+
+    job_id = payload.get('job_id')
+    callback_type = payload.get('type')
+    status = payload.get('status')
+
+    job = job_manager.get_job(job_id)
+    if not job:
+        return _resp({'received': False, 'error': 'Job not found'}, 404)
+
+    new_status = STATUS_MAP.get((callback_type, status))
+    if new_status is None:
+        return _resp({
+            'received': False,
+            'error': f'Unknown callback type/status: {callback_type}/{status}'
+        }, 400)
+
+    now_iso = _now_iso()
+    updates = {
+        'status': new_status,
+        'updated_at': now_iso
+    }
+    if new_status == JobStatus.VALIDATION_FAILED:
+        # Preserve failure history on the job
+        job_data = job['job_data'] or {}
+        job_data.setdefault('failure', {}).setdefault('validation_failed', []).append({
+            'err': payload.get('err', ''),
+            'received_at': now_iso
+        })
+        updates['job_data'] = job_data
+
+    # Update job and record the callback activity in one pass
+    job_manager.update_and_log(
+        job_id,
+        updates,
+        entity='feed_generation_job',
+        source=ActivitySource.CALLBACK,
+        requested_by='script',
+        activity_data={
+            'request_path': '/api/callback/feed',
+            'request_body': payload,
+            'action': 'callback'
+        }
+    )
+
+    # Wake any long-poll status waiters for this job
+    _wake_waiters(job_id)
+
+    return _resp({'received': True})
+
+
+def execute_validation_script(job_id, delay_s=0):
+    """Queue validation for background execution (Celery if configured, else worker pool)"""
+    if tasks.celery is not None:
+        tasks.run_validation.apply_async(args=[job_id], countdown=delay_s)
+    elif delay_s:
+        # Delayed jobs are scheduled with an OS timer; a pool worker is only
+        # occupied once the delay has elapsed, instead of sleeping through it
+        timer = threading.Timer(delay_s, JOB_EXECUTOR.submit,
+                                args=(process_validation_job, job_id))
+        timer.daemon = True
+        timer.start()
+    else:
+        JOB_EXECUTOR.submit(process_validation_job, job_id)
+
+
+def process_validation_job(job_id):
+    """Run the validation script for a job and record the outcome (local execution)"""
+    try:
+        job = job_manager.get_job(job_id)
+        if not job:
+            app.logger.error('Job not found for validation: %s', job_id)
+            return
+
+        job_data = job['job_data'] or {}
+
+        opts = {
+            'mode': 'local',  # Always local since we're on same EC2
+            'ec2_host': None,  # Not needed for local execution
+            'ec2_user': None,  # Not needed for local execution
+            'key_path': None,   # Not needed for local execution
+            'logs_dir': LOGS_DIR,
+            'run_at': None,    # Not needed for local execution
+            'partner_id': job['partner_id'],
+            's3_feed_file': job_data.get('validation_source_s3_path'),
+            's3_output_path': job_data.get('validation_destination_s3_path'),
+            'distinguish_id': f"{job_id}_validation",
+            'callback_url': None,  # Will be built from environment in run_script_local.py
+            'job_id': job_id,
+            'type': 'feed_validation',
+            'log_timeout': LOG_CHECK_TIMEOUT,
+            'log_poll_interval': LOG_POLL_INTERVAL,
+        }
+
+        # Execute script
+        result = execute_and_notify(opts)
+
+        # The script's callback may have already landed on /api/callback/feed and
+        # recorded the terminal status; re-read so we can coalesce the duplicate
+        # full-file rewrite instead of thrashing the job store
+        current = job_manager.get_job(job_id) or job
+
+        # Update job status based on result
+        if result and isinstance(result, dict) and result.get('destination'):
+            # Script succeeded, update status to validated and update destination path
+            job_data = current['job_data'] or {}
+            # Use actual filename from script output
+            script_output_path = result.get('destination')
+            if (current['status'] == JobStatus.VALIDATED and
+                    job_data.get('validation_destination_s3_path') == script_output_path):
+                app.logger.info('Validation already recorded via callback for job %s', job_id)
+            else:
                 job_data.update({
                     'validation_destination_s3_path': script_output_path
                 })
                 job_manager.update_job(job_id, {
                     'status': JobStatus.VALIDATED,
                     'job_data': job_data,
-                    'updated_at': datetime.utcnow().isoformat()
+                    'updated_at': _now_iso()
                 })
-                app.logger.info('Validation script completed successfully for job %s', job_id)
+            app.logger.info('Validation script completed successfully for job %s', job_id)
+        else:
+            if current['status'] == JobStatus.VALIDATION_FAILED:
+                app.logger.info('Validation failure already recorded via callback for job %s', job_id)
             else:
                 # Script failed, update status immediately
                 job_manager.update_job(job_id, {
                     'status': JobStatus.VALIDATION_FAILED,
-                    'updated_at': datetime.utcnow().isoformat()
+                    'updated_at': _now_iso()
                 })
-                app.logger.error('Validation script failed for job %s', job_id)
-            
-        except Exception as e:
-            app.logger.error('Validation job error: %s', e)
-            # Update job status to failed
-            job_manager.update_job(job_id, {
-                'status': JobStatus.VALIDATION_FAILED,
-                'updated_at': datetime.utcnow().isoformat()
-            })
-    
-    thread = threading.Thread(target=background, daemon=True)
-    thread.start()
+            app.logger.error('Validation script failed for job %s', job_id)
+
+        _wake_waiters(job_id)
+
+    except Exception as e:
+        app.logger.error('Validation job error: %s', e)
+        # Update job status to failed
+        job_manager.update_job(job_id, {
+            'status': JobStatus.VALIDATION_FAILED,
+            'updated_at': _now_iso()
+        })
+        _wake_waiters(job_id)
 
 
 if __name__ == '__main__':
@@ -1,23 +1,345 @@
+import copy
 import json
 import os
+import sqlite3
 import uuid
+from collections import OrderedDict
 from datetime import datetime
 from typing import Dict, List, Optional
 import threading
 
+try:
+    import orjson
+except ImportError:
+    # orjson is optional; the stdlib json fallback produces equivalent files
+    orjson = None
+
+
+def _dump_json(obj) -> bytes:
+    """Serialize to bytes, preferring orjson's C encoder"""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2)
+    return json.dumps(obj, indent=2).encode('utf-8')
+
+
+def _load_json_file(path: str):
+    """Read and parse a JSON file as bytes (skips the text-mode decode step)"""
+    with open(path, 'rb') as f:
+        data = f.read()
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def _atomic_write(path: str, data: bytes):
+    """Write to a temp file in the target directory, then os.replace it in.
+
+    The rename is atomic on POSIX and Windows, so lock-free readers always
+    see either the old or the new file — never a torn write — and a crash
+    can't leave half-written JSON behind.
+    """
+    tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp, 'wb') as f:
+        f.write(data)
+        f.flush()
+    os.replace(tmp, path)
+
+
+class _Index:
+    """SQLite index over the job/activity JSON files.
+
+    The JSON files stay the source of truth; this index only mirrors the
+    lookup columns so get-by-merchant and activity queries become a single
+    indexed SELECT instead of a directory scan. It is ephemeral — delete
+    jobs.db and reindex() rebuilds it from the files.
+    """
+
+    def __init__(self, db_file: str):
+        self._conn = sqlite3.connect(db_file, check_same_thread=False)
+        self._lock = threading.Lock()
+        self._conn.executescript("""
+            PRAGMA journal_mode=WAL;
+            PRAGMA synchronous=NORMAL;
+            PRAGMA temp_store=MEMORY;
+            PRAGMA cache_size=-32000;
+            PRAGMA mmap_size=268435456;
+            CREATE TABLE IF NOT EXISTS jobs(
+                id TEXT PRIMARY KEY,
+                affiliate_merchant_id TEXT,
+                partner_id TEXT,
+                status TEXT,
+                updated_at TEXT
+            );
+            CREATE INDEX IF NOT EXISTS idx_jobs_amid ON jobs(affiliate_merchant_id);
+            CREATE TABLE IF NOT EXISTS activities(
+                id TEXT PRIMARY KEY,
+                entity_id TEXT,
+                created_at TEXT
+            );
+            CREATE INDEX IF NOT EXISTS idx_act_entity ON activities(entity_id, created_at);
+        """)
+
+    def upsert_job(self, job: Dict):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO jobs(id, affiliate_merchant_id, partner_id, status, updated_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (job['id'], job.get('affiliate_merchant_id'), job.get('partner_id'),
+                 job.get('status'), job.get('updated_at'))
+            )
+            self._conn.commit()
+
+    # Columns a plain status flip touches; updates limited to these can use a
+    # targeted UPDATE instead of re-writing the whole index row
+    SCALAR_COLS = frozenset({"status", "retry_count", "updated_at"})
+
+    def update_job_scalars(self, job: Dict):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET status=?, updated_at=? WHERE id=?",
+                (job.get('status'), job.get('updated_at'), job['id'])
+            )
+            self._conn.commit()
+
+    def upsert_activity(self, activity: Dict):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO activities(id, entity_id, created_at) VALUES (?, ?, ?)",
+                (activity['id'], activity.get('entity_id'), activity.get('created_at'))
+            )
+            self._conn.commit()
+
+    def activity_ids_for(self, entity_id: str) -> List[str]:
+        """Activity IDs for an entity, already ordered by created_at"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id FROM activities WHERE entity_id=? ORDER BY created_at",
+                (entity_id,)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def find_job_by_affiliate_merchant(self, affiliate_merchant_id: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id FROM jobs WHERE affiliate_merchant_id=? LIMIT 1",
+                (affiliate_merchant_id,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def job_ids_page(self, limit: int, offset: int, status: Optional[str] = None) -> List[str]:
+        """Page of job IDs, most recently updated first"""
+        with self._lock:
+            if status:
+                rows = self._conn.execute(
+                    "SELECT id FROM jobs WHERE status=? ORDER BY updated_at DESC LIMIT ? OFFSET ?",
+                    (status, limit, offset)
+                ).fetchall()
+            else:
+                rows = self._conn.execute(
+                    "SELECT id FROM jobs ORDER BY updated_at DESC LIMIT ? OFFSET ?",
+                    (limit, offset)
+                ).fetchall()
+        return [row[0] for row in rows]
+
+    def job_count(self, status: Optional[str] = None) -> int:
+        with self._lock:
+            if status:
+                return self._conn.execute(
+                    "SELECT COUNT(*) FROM jobs WHERE status=?", (status,)
+                ).fetchone()[0]
+            return self._conn.execute("SELECT COUNT(*) FROM jobs").fetchone()[0]
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM jobs")
+            self._conn.execute("DELETE FROM activities")
+            self._conn.commit()
+
+
+class FileBasedJobIdMap:
+    """Persistent frontend<->backend job ID mapping.
+
+    Backed by a single JSON file so mappings survive process restarts and
+    are visible to sibling workers, instead of living in per-process dicts.
+    """
+
+    def __init__(self, map_file="./job_id_map.json"):
+        self.map_file = map_file
+        self._lock = threading.RLock()
+        self._forward: Dict[str, str] = {}  # frontend -> backend
+        self._reverse: Dict[str, str] = {}  # backend -> frontend
+        self._mtime_ns = None
+        self._load()
+
+    def _load(self):
+        """(Re)read the map file, remembering its mtime so lookups can tell
+        when a sibling worker has replaced it since"""
+        try:
+            mtime_ns = os.stat(self.map_file).st_mtime_ns
+        except OSError:
+            return
+        data = _load_json_file(self.map_file)
+        self._forward = data.get('frontend_to_backend', {})
+        self._reverse = data.get('backend_to_frontend', {})
+        self._mtime_ns = mtime_ns
+
+    def _refresh(self):
+        """Reload if another process has written the file since our last read
+        (same mtime validation the job cache uses). Caller holds the lock."""
+        try:
+            mtime_ns = os.stat(self.map_file).st_mtime_ns
+        except OSError:
+            return
+        if mtime_ns != self._mtime_ns:
+            self._load()
+
+    def add(self, frontend_job_id, backend_job_id: str):
+        # Frontend IDs may arrive as ints; normalize so URL lookups match
+        key = str(frontend_job_id)
+        with self._lock:
+            self._refresh()
+            self._forward[key] = backend_job_id
+            self._reverse[backend_job_id] = key
+            _atomic_write(self.map_file, _dump_json({
+                'frontend_to_backend': self._forward,
+                'backend_to_frontend': self._reverse
+            }))
+            try:
+                self._mtime_ns = os.stat(self.map_file).st_mtime_ns
+            except OSError:
+                self._mtime_ns = None
+
+    def get_backend(self, frontend_job_id, default=None) -> Optional[str]:
+        with self._lock:
+            self._refresh()
+            return self._forward.get(str(frontend_job_id), default)
+
+    def get_frontend(self, backend_job_id, default=None) -> Optional[str]:
+        with self._lock:
+            self._refresh()
+            return self._reverse.get(backend_job_id, default)
+
+    def snapshot(self):
+        """Copies of both mappings (for the debug endpoint)"""
+        with self._lock:
+            self._refresh()
+            return dict(self._forward), dict(self._reverse)
+
+
 class FileBasedJobManager:
-    def __init__(self, jobs_dir="./jobs", activities_dir="./activities"):
+    def __init__(self, jobs_dir="./jobs", activities_dir="./activities",
+                 cache_size=None, index_file="./jobs.db"):
         self.jobs_dir = jobs_dir
         self.activities_dir = activities_dir
-        self._lock = threading.Lock()
-        
+
+        # Striped write locks: writers only contend when they touch the same
+        # stripe, instead of serializing every operation behind one lock.
+        # Readers/scans take no lock at all.
+        self._stripes = [threading.Lock() for _ in range(64)]
+        self._cache_lock = threading.Lock()
+
+        # In-memory LRU of parsed job JSON keyed by job_id, validated by file
+        # mtime so external changes are picked up; write-through on create/update
+        self._cache: OrderedDict = OrderedDict()  # job_id -> (mtime_ns, job)
+        if cache_size is None:
+            cache_size = int(os.getenv('JOB_CACHE_SIZE', 1024))
+        self._cache_size = cache_size
+
         # Create directories if they don't exist
         os.makedirs(jobs_dir, exist_ok=True)
         os.makedirs(activities_dir, exist_ok=True)
-    
+
+        # SQLite lookup index over the JSON files; rebuild it from the
+        # directories if it is empty (fresh or deleted db)
+        self._index = _Index(index_file)
+        if self._index.job_count() == 0:
+            self.reindex()
+
+    @staticmethod
+    def _shard_path(root: str, file_id: str) -> str:
+        """Sharded location for a JSON file: <root>/<2-hex prefix>/<id>.json"""
+        return os.path.join(root, file_id[:2], f"{file_id}.json")
+
+    def _find_json(self, root: str, file_id: str) -> str:
+        """Path for an ID, preferring the sharded layout with a fallback to
+        legacy flat files written before sharding"""
+        sharded = self._shard_path(root, file_id)
+        if os.path.exists(sharded):
+            return sharded
+        legacy = os.path.join(root, f"{file_id}.json")
+        if os.path.exists(legacy):
+            return legacy
+        return sharded
+
+    def _activity_path(self, entity_id: str, activity_id: str) -> str:
+        """Location for a new activity: <activities_dir>/<entity_id>/<id>.json"""
+        return os.path.join(self.activities_dir, entity_id, f"{activity_id}.json")
+
+    def _find_activity(self, entity_id: str, activity_id: str) -> str:
+        """Path for an activity, preferring the per-entity layout with
+        fallbacks to the older hex-shard and flat layouts"""
+        grouped = self._activity_path(entity_id, activity_id)
+        if os.path.exists(grouped):
+            return grouped
+        return self._find_json(self.activities_dir, activity_id)
+
+    @staticmethod
+    def _iter_json_files(root: str):
+        """Yield every .json path under root (legacy flat files plus shard subdirs)"""
+        with os.scandir(root) as entries:
+            for entry in entries:
+                if entry.name.endswith('.json'):
+                    yield entry.path
+                elif entry.is_dir():
+                    with os.scandir(entry.path) as sub_entries:
+                        for sub in sub_entries:
+                            if sub.name.endswith('.json'):
+                                yield sub.path
+
+    def reindex(self):
+        """Rebuild the SQLite index from the job/activity JSON files"""
+        self._index.clear()
+        for job_file in self._iter_json_files(self.jobs_dir):
+            self._index.upsert_job(_load_json_file(job_file))
+        for activity_file in self._iter_json_files(self.activities_dir):
+            self._index.upsert_activity(_load_json_file(activity_file))
+
+    def _lock_for(self, file_id: str) -> threading.Lock:
+        """Write-lock stripe for a job/activity ID"""
+        return self._stripes[hash(file_id) % len(self._stripes)]
+
+    def _cache_get(self, job_id: str, mtime_ns: int) -> Optional[Dict]:
+        """Return the cached job if still fresh (caller holds no lock).
+
+        The returned dict is the cached object itself; callers must copy
+        before mutating or handing it out."""
+        with self._cache_lock:
+            entry = self._cache.get(job_id)
+            if entry and entry[0] == mtime_ns:
+                self._cache.move_to_end(job_id)
+                return entry[1]
+        return None
+
+    def _cache_put(self, job_id: str, job_file: str, job: Dict):
+        """Insert/refresh a cache entry, evicting the oldest past capacity.
+
+        Writers must call this while still holding _lock_for(job_id): the
+        stat has to see the bytes this thread wrote, or a delayed thread
+        tags its stale dict with a newer writer's mtime."""
+        try:
+            mtime_ns = os.stat(job_file).st_mtime_ns
+        except OSError:
+            return
+        with self._cache_lock:
+            self._cache[job_id] = (mtime_ns, job)
+            self._cache.move_to_end(job_id)
+            while len(self._cache) > self._cache_size:
+                self._cache.popitem(last=False)
+
     def create_job(self, affiliate_merchant_id: str, partner_id: str, job_data: Dict) -> str:
         """Create a new job"""
         job_id = str(uuid.uuid4())
+        now = datetime.utcnow().isoformat()
         job = {
             "id": job_id,
             "affiliate_merchant_id": affiliate_merchant_id,
@@ -26,57 +348,120 @@ class FileBasedJobManager:
             "status": "generating",
             "retry_count": 0,
             "job_data": job_data,
-            "created_at": datetime.utcnow().isoformat(),
-            "updated_at": datetime.utcnow().isoformat()
+            "created_at": now,
+            "updated_at": now
         }
         
-        job_file = os.path.join(self.jobs_dir, f"{job_id}.json")
-        with self._lock:
-            with open(job_file, 'w') as f:
-                json.dump(job, f, indent=2)
-        
+        job_file = self._shard_path(self.jobs_dir, job_id)
+        os.makedirs(os.path.dirname(job_file), exist_ok=True)
+        with self._lock_for(job_id):
+            _atomic_write(job_file, _dump_json(job))
+            self._cache_put(job_id, job_file, job)
+        self._index.upsert_job(job)
+
         return job_id
-    
+
     def get_job(self, job_id: str) -> Optional[Dict]:
         """Get job by ID"""
-        job_file = os.path.join(self.jobs_dir, f"{job_id}.json")
-        if not os.path.exists(job_file):
+        job_file = self._find_json(self.jobs_dir, job_id)
+        try:
+            mtime_ns = os.stat(job_file).st_mtime_ns
+        except OSError:
             return None
-        
-        with open(job_file, 'r') as f:
-            return json.load(f)
+
+        cached = self._cache_get(job_id, mtime_ns)
+        if cached is not None:
+            return copy.deepcopy(cached)
+
+        job = _load_json_file(job_file)
+        self._cache_put(job_id, job_file, job)
+        # Hand out a copy so callers mutating the result (e.g. appending to
+        # job_data) can't write into the cache behind its mtime tag
+        return copy.deepcopy(job)
     
     def get_job_by_affiliate_merchant(self, affiliate_merchant_id: str) -> Optional[Dict]:
-        """Find job by affiliate merchant ID (requires scanning all files)"""
-        with self._lock:
-            for filename in os.listdir(self.jobs_dir):
-                if filename.endswith('.json'):
-                    job_file = os.path.join(self.jobs_dir, filename)
-                    with open(job_file, 'r') as f:
-                        job = json.load(f)
-                        if job.get('affiliate_merchant_id') == affiliate_merchant_id:
-                            return job
-        return None
+        """Find job by affiliate merchant ID (single indexed lookup)"""
+        job_id = self._index.find_job_by_affiliate_merchant(affiliate_merchant_id)
+        if job_id is None:
+            return None
+        return self.get_job(job_id)
     
     def update_job(self, job_id: str, updates: Dict) -> bool:
         """Update job with new data"""
-        job_file = os.path.join(self.jobs_dir, f"{job_id}.json")
+        job_file = self._find_json(self.jobs_dir, job_id)
         if not os.path.exists(job_file):
             return False
         
-        with self._lock:
-            with open(job_file, 'r') as f:
-                job = json.load(f)
-            
+        with self._lock_for(job_id):
+            # Reuse the cached parse when it is still current, so a plain
+            # status flip doesn't pay a disk read + full job_data parse
+            try:
+                mtime_ns = os.stat(job_file).st_mtime_ns
+            except OSError:
+                return False
+            job = self._cache_get(job_id, mtime_ns)
+            if job is None:
+                job = _load_json_file(job_file)
+            else:
+                # Merge into a copy: mutating the cached dict in place would
+                # leave unpersisted state behind a matching mtime tag if the
+                # write below fails, and lock-free readers could observe the
+                # update half-applied
+                job = copy.deepcopy(job)
+
             job.update(updates)
             job['updated_at'] = datetime.utcnow().isoformat()
-            
-            with open(job_file, 'w') as f:
-                json.dump(job, f, indent=2)
-        
+
+            _atomic_write(job_file, _dump_json(job))
+            self._cache_put(job_id, job_file, job)
+        if set(updates) <= _Index.SCALAR_COLS:
+            self._index.update_job_scalars(job)
+        else:
+            self._index.upsert_job(job)
+
         return True
-    
-    def create_activity(self, entity: str, entity_id: str, source: str, 
+
+    def update_and_log(self, job_id: str, updates: Dict, entity: str, source: str,
+                       requested_by: str, activity_data: Dict) -> bool:
+        """Update a job and record its activity in a single locked pass.
+
+        Callers previously did update_job() followed by create_activity(),
+        paying two lock round-trips per request; this batches both writes
+        under one critical section. The activity still lands in its own
+        file so get_job_activities keeps working unchanged.
+        """
+        job_file = self._find_json(self.jobs_dir, job_id)
+        if not os.path.exists(job_file):
+            return False
+
+        now = datetime.utcnow().isoformat()
+        activity = {
+            "id": str(uuid.uuid4()),
+            "entity": entity,
+            "entity_id": job_id,
+            "source": source,
+            "requested_by": requested_by,
+            "activity": activity_data,
+            "created_at": now
+        }
+        activity_file = self._activity_path(job_id, activity['id'])
+        os.makedirs(os.path.dirname(activity_file), exist_ok=True)
+
+        with self._lock_for(job_id):
+            job = _load_json_file(job_file)
+
+            job.update(updates)
+            job['updated_at'] = now
+
+            _atomic_write(job_file, _dump_json(job))
+            _atomic_write(activity_file, _dump_json(activity))
+            self._cache_put(job_id, job_file, job)
+        self._index.upsert_job(job)
+        self._index.upsert_activity(activity)
+
+        return True
+
+    def create_activity(self, entity: str, entity_id: str, source: str,
                        requested_by: str, activity_data: Dict) -> str:
         """Create an activity record"""
         activity_id = str(uuid.uuid4())
@@ -90,37 +475,41 @@ class FileBasedJobManager:
             "created_at": datetime.utcnow().isoformat()
         }
         
-        activity_file = os.path.join(self.activities_dir, f"{activity_id}.json")
-        with self._lock:
-            with open(activity_file, 'w') as f:
-                json.dump(activity, f, indent=2)
-        
+        activity_file = self._activity_path(entity_id, activity_id)
+        os.makedirs(os.path.dirname(activity_file), exist_ok=True)
+        with self._lock_for(activity_id):
+            _atomic_write(activity_file, _dump_json(activity))
+        self._index.upsert_activity(activity)
+
         return activity_id
     
     def get_job_activities(self, job_id: str) -> List[Dict]:
-        """Get all activities for a job (requires scanning all activity files)"""
+        """Get all activities for a job via the index (one ordered query,
+        then only the matching files are read)"""
         activities = []
-        with self._lock:
-            for filename in os.listdir(self.activities_dir):
-                if filename.endswith('.json'):
-                    activity_file = os.path.join(self.activities_dir, filename)
-                    with open(activity_file, 'r') as f:
-                        activity = json.load(f)
-                        if activity.get('entity_id') == job_id:
-                            activities.append(activity)
-        
-        # Sort by created_at
-        activities.sort(key=lambda x: x.get('created_at', ''))
+        for activity_id in self._index.activity_ids_for(job_id):
+            activity_file = self._find_activity(job_id, activity_id)
+            try:
+                activities.append(_load_json_file(activity_file))
+            except OSError:
+                # Index row outlived its file; skip it (reindex() repairs)
+                continue
         return activities
     
-    def list_all_jobs(self) -> List[Dict]:
-        """List all jobs (can be slow with many jobs)"""
+    def list_all_jobs(self, limit: int = 100, offset: int = 0, status: Optional[str] = None) -> List[Dict]:
+        """List jobs page by page, most recently updated first.
+
+        Resolves the page of IDs from the SQLite index and loads each job
+        through get_job so hot entries come out of the cache instead of
+        re-reading every file on disk.
+        """
         jobs = []
-        with self._lock:
-            for filename in os.listdir(self.jobs_dir):
-                if filename.endswith('.json'):
-                    job_file = os.path.join(self.jobs_dir, filename)
-                    with open(job_file, 'r') as f:
-                        jobs.append(json.load(f))
-        
+        for job_id in self._index.job_ids_page(limit, offset, status):
+            job = self.get_job(job_id)
+            if job is not None:
+                jobs.append(job)
         return jobs
+
+    def count_jobs(self, status: Optional[str] = None) -> int:
+        """Total number of jobs (optionally per status), from the index"""
+        return self._index.job_count(status)
@@ -1,9 +1,14 @@
 import os
 import re
-import shlex
 import subprocess
 import requests
-import logging
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+try:
+    import picologging as logging
+except ImportError:
+    # picologging (C-implemented, API-compatible) is optional; stdlib works fine
+    import logging
 import time
 import json
 from datetime import datetime, timedelta
@@ -23,6 +28,19 @@ logging.basicConfig(level=logging.INFO)
 CALLBACK_LOGS_DIR = os.path.join(os.getcwd(), 'callback_logs')
 os.makedirs(CALLBACK_LOGS_DIR, exist_ok=True)
 
+# Shared HTTP session so callbacks reuse keep-alive connections (and DNS)
+# instead of paying a fresh TCP/TLS handshake per POST
+_SESSION = requests.Session()
+_adapter = HTTPAdapter(pool_connections=10, pool_maxsize=10,
+                       max_retries=Retry(total=3, backoff_factor=0.2))
+_SESSION.mount('http://', _adapter)
+_SESSION.mount('https://', _adapter)
+
+# Log-parsing patterns, compiled once at import instead of per parse
+_SUCCESS_RE = re.compile(r"Script finished successfully at:")
+# Matches both "Upload completed:" and "upload: ... to s3://"
+_UPLOAD_RE = re.compile(r"(?:Upload completed:|upload:.*?to)\s+(s3://[^\s]+)")
+
 def write_callback_log(log_entry):
     """Write callback log entry to file"""
     try:
@@ -78,17 +96,17 @@ def write_callback_result_to_logs(job_id, status, payload, callback_url):
         logger.error('Failed to write callback result to logs: %s', e)
 
 
-def run_cmd(cmd, timeout=None):
-    """Run command locally without SSH"""
-    logger.info('Running locally: %s', cmd)
-    completed = subprocess.run(cmd, shell=True, capture_output=True, text=True, timeout=timeout)
+def run_cmd(argv, timeout=None):
+    """Run command locally without SSH (argv list; no /bin/sh fork, no quoting)"""
+    logger.info('Running locally: %s', ' '.join(argv))
+    completed = subprocess.run(argv, capture_output=True, text=True, timeout=timeout)
     logger.info('Returncode: %s', completed.returncode)
     if completed.stdout:
         logger.info('stdout:\n%s', completed.stdout)
     if completed.stderr:
         logger.info('stderr:\n%s', completed.stderr)
     if completed.returncode != 0:
-        raise RuntimeError(f'Command failed ({completed.returncode}): {cmd}\n{completed.stderr}')
+        raise RuntimeError(f'Command failed ({completed.returncode}): {" ".join(argv)}\n{completed.stderr}')
     return completed.stdout
 
 
@@ -123,15 +141,17 @@ def send_callback(callback_url, job_id, type_, status, destination_s3_path, err_
         'payload': payload
     }
     
-    # Log callback attempt
-    logger.info('🚀 CALLBACK SENDING: %s', callback_log)
+    # Log callback attempt (full payload only at DEBUG; repr of large result
+    # dicts is too expensive for the per-callback INFO path)
+    logger.info('🚀 CALLBACK SENDING: job %s -> %s', job_id, callback_url)
+    logger.debug('Callback payload: %s', callback_log)
     write_callback_log(callback_log)
     
     # Write callback result to logs folder for testing
     write_callback_result_to_logs(job_id, 'sending', payload, callback_url)
     
     try:
-        response = requests.post(callback_url, json=payload, timeout=30)
+        response = _SESSION.post(callback_url, json=payload, timeout=30)
         response.raise_for_status()
         
         # Log success
@@ -143,7 +163,8 @@ def send_callback(callback_url, job_id, type_, status, destination_s3_path, err_
             'response_status': response.status_code,
             'response_body': response.text[:500]  # Limit response size
         }
-        logger.info('✅ CALLBACK SUCCESS: %s', success_log)
+        logger.info('✅ CALLBACK SUCCESS: job %s (%s)', job_id, response.status_code)
+        logger.debug('Callback response: %s', success_log)
         write_callback_log(success_log)
         write_callback_result_to_logs(job_id, 'success', payload, callback_url)
         
@@ -204,15 +225,41 @@ def send_callback(callback_url, job_id, type_, status, destination_s3_path, err_
         raise
 
 
+def follow_log_until_success(log_path, grace_s, step_s=0.2):
+    """Stream a log file from disk until the success marker appears.
+
+    Local equivalent of `tail -F`: reads incrementally from the last offset
+    and returns as soon as the marker lands, instead of sleeping a fixed
+    interval and reading once. grace_s bounds how long we wait for the
+    marker (the script has already exited; only flush lag remains), so a
+    failed run is still detected quickly.
+    """
+    deadline = time.monotonic() + grace_s
+    content = ''
+    offset = 0
+    while True:
+        try:
+            with open(log_path, 'rb') as f:
+                f.seek(offset)
+                chunk = f.read()
+        except OSError:
+            chunk = b''
+        if chunk:
+            offset += len(chunk)
+            content += chunk.decode('utf-8', 'replace')
+            if _SUCCESS_RE.search(content):
+                break
+        if time.monotonic() >= deadline:
+            break
+        time.sleep(step_s)
+    return content
+
+
 def parse_log_for_upload(log_content, job_id):
     """Parse log content to check if script completed successfully and find S3 upload"""
     # Look for the exact success pattern from the log
-    success_pattern = r"Script finished successfully at:"
-    
-    if re.search(success_pattern, log_content):
-        # Look for S3 upload pattern (matches both "Upload completed:" and "upload: ... to s3://")
-        upload_pattern = r"(?:Upload completed:|upload:.*?to)\s+(s3://[^\s]+)"
-        upload_match = re.search(upload_pattern, log_content)
+    if _SUCCESS_RE.search(log_content):
+        upload_match = _UPLOAD_RE.search(log_content)
         if upload_match:
             return upload_match.group(1)
         else:
@@ -252,10 +299,10 @@ def execute_locally(opts):
     # Ensure logs directory exists
     os.makedirs(logs_dir, exist_ok=True)
     
-    # Construct script command
+    # Construct script command as an argv list (no shell involved)
     script_path = os.path.join(os.path.dirname(__file__), 'scripts', 'analyze_feed.sh')
-    
-    cmd = f"bash {script_path} {partner_id} {s3_feed_file} {s3_output_path} {distinguish_id}"
+
+    cmd = ['bash', script_path, str(partner_id), str(s3_feed_file), str(s3_output_path), str(distinguish_id)]
     
     logger.info('Starting local script execution for job %s', job_id)
     
@@ -272,7 +319,7 @@ def execute_locally(opts):
         if not log_files:
             logger.warning('No log file found for job %s', job_id)
             # Create a mock log file for testing
-            log_file = os.path.join(logs_dir, f"analyze_feed_partner_{partner_id}_{distinguish_id}_{int(time.time())}.log")
+            log_file = os.path.join(logs_dir, f"analyze_feed_partner_{partner_id}_{distinguish_id}_{time.monotonic_ns()}.log")
             with open(log_file, 'w') as f:
                 f.write(f"Script started at: {datetime.now()}\n")
                 f.write(f"Processing partner: {partner_id}\n")
@@ -284,13 +331,10 @@ def execute_locally(opts):
         
         # Get the most recent log file
         latest_log = max(log_files, key=os.path.getmtime)
-        
-        # Wait a bit for script to complete and write logs
-        time.sleep(2)
-        
-        # Read log content
-        with open(latest_log, 'r') as f:
-            log_content = f.read()
+
+        # Follow the log until the success marker appears (bounded by one
+        # poll interval of flush grace) instead of a fixed 2s sleep + read
+        log_content = follow_log_until_success(latest_log, grace_s=log_poll_interval)
         
         # Parse for script completion success
         result = parse_log_for_upload(log_content, job_id)
@@ -0,0 +1,23 @@
+import os
+
+try:
+    from celery import Celery
+except Exception:
+    # Celery is optional; without it jobs run on the in-process worker pool
+    Celery = None
+
+# Celery app is only created when a broker is configured, so local/dev runs
+# keep working with no Redis dependency
+celery = None
+if Celery is not None and os.getenv('REDIS_URL'):
+    celery = Celery(
+        'feed_api',
+        broker=os.getenv('REDIS_URL'),
+        backend=os.getenv('REDIS_URL')
+    )
+
+    @celery.task(bind=True, max_retries=3)
+    def run_validation(self, job_id):
+        # Imported lazily to avoid a circular import with app.py
+        from app import process_validation_job
+        return process_validation_job(job_id)